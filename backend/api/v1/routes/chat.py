@@ -1,139 +1,260 @@
 """
 Chat router — Gemini-powered chat with S3 persistence.
 """
-from fastapi import APIRouter, Query, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timezone
+import hashlib
+import json
 import uuid
 
+from backend.core.cache import chat_context_cache
 from backend.schemas.chat import ChatMessageSchema, ChatMessageRequest
 from backend.services.storage.s3_service import s3_service
-from backend.services.chat_ai.gemini_service import gemini_service
+from backend.services.chat_ai.gemini_service import gemini_service, HISTORY_WINDOW
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+# Each chat log object holds one user/AI exchange
+_TURNS_IN_WINDOW = (HISTORY_WINDOW + 1) // 2
 
-def _load_latest_context(email: str) -> dict:
-    """Load the latest analysis, routine, and concerns for chat context."""
+# Sessions with more log objects than this have all but the window's turns
+# compacted into one transcript, which bounds the GETs a history read makes
+_MAX_CHAT_OBJECTS = 20
+
+
+def _load_latest_context(
+    email: str, profile: Optional[dict], pointer: Optional[dict], index: Optional[list]
+) -> dict:
+    """Build chat context from the profile and the latest scan snapshot."""
     context: dict = {}
 
-    # Get profile for user name
-    profile = s3_service.get_json(s3_service.profile_key(email))
+    # Profile, pointer and scan index are fetched by the caller in one batch
     if profile:
         context["user_name"] = profile.get("name")
 
-    # Find latest scan
-    prefixes = s3_service.list_prefixes(s3_service.scans_prefix(email))
-    if not prefixes:
+    # Latest scan, routine and concerns come from one snapshot object
+    latest = s3_service.resolve_latest_snapshot(email, pointer, index)
+    if latest is None:
         return context
 
-    # Collect scans with dates
-    scans = []
-    for prefix in prefixes:
-        scan_id = prefix.rstrip("/").split("/")[-1]
-        analysis = s3_service.get_json(s3_service.analysis_key(email, scan_id))
-        if analysis:
-            scans.append((scan_id, analysis))
+    context["latest_analysis"] = latest["analysis"]
+    if latest.get("routine"):
+        context["routine"] = latest["routine"]
+    if latest.get("concerns"):
+        context["concerns"] = latest["concerns"]
 
-    if not scans:
-        return context
+    return context
 
-    # Sort by date descending, pick latest
-    scans.sort(key=lambda x: x[1].get("date", ""), reverse=True)
-    latest_scan_id, latest_analysis = scans[0]
 
-    context["latest_analysis"] = latest_analysis
+def _listing_etag(keys: List[str]) -> str:
+    """ETag for a session's chat log key listing."""
+    return '"%s"' % hashlib.md5("\n".join(keys).encode()).hexdigest()
 
-    routine = s3_service.get_json(s3_service.routine_key(email, latest_scan_id))
-    if routine:
-        context["routine"] = routine
 
-    concerns = s3_service.get_json(s3_service.concerns_key(email, latest_scan_id))
-    if concerns:
-        context["concerns"] = concerns
+def _compact_session(
+    email: str, session_id: str, keys: List[str], chunks: Optional[list] = None
+) -> None:
+    """
+    Fold all but the newest _TURNS_IN_WINDOW log objects of an oversized
+    session into one transcript. The objects a chat turn reads stay small
+    per-turn ones. Chunks already downloaded for keys are reused. Runs as a
+    background task, after the response is sent.
+    """
+    if len(keys) <= _MAX_CHAT_OBJECTS:
+        return
+    folded = keys[:-_TURNS_IN_WINDOW]
+    if chunks is None:
+        chunks = s3_service.get_json_many(folded)
+    s3_service.compact_chat(
+        email, session_id, folded, s3_service.merge_chat_chunks(chunks[:len(folded)])
+    )
 
-    return context
 
+def _compact_sessions(email: str, sessions: Dict[str, Tuple[List[str], list]]) -> None:
+    """Compact every oversized session of a merged history read."""
+    for session_id, (keys, chunks) in sessions.items():
+        _compact_session(email, session_id, keys, chunks)
 
-@router.post("/message", response_model=ChatMessageSchema)
-def send_message(
-    body: ChatMessageRequest,
-    email: str = Query(..., description="User email"),
-):
-    """Send a message and get an AI response."""
+
+def _start_turn(email: str, body: ChatMessageRequest) -> dict:
+    """Load recent history and context, and build the user's message."""
     if not email or "@" not in email:
         raise HTTPException(status_code=400, detail="Valid email required")
 
     session_id = body.sessionId or str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    started = datetime.now(timezone.utc)
+
+    # List the session on the S3 pool while the context loads, so a cold
+    # context cache adds no round trip before the turn objects are read
+    chat_keys_future = s3_service.submit(s3_service.get_chat_keys, email, session_id)
 
-    # Load existing conversation
-    chat_key = s3_service.chat_key(email, session_id)
-    messages = s3_service.get_json(chat_key) or []
+    context = chat_context_cache.get(email)
+    if context is None:
+        # Load the profile, latest-scan snapshot and scan index together; the
+        # index catches a snapshot left behind by overlapping uploads
+        profile, pointer, index = s3_service.get_json_many([
+            s3_service.profile_key(email),
+            s3_service.latest_scan_key(email),
+            s3_service.scans_index_key(email),
+        ])
+        context = _load_latest_context(email, profile, pointer, index)
+        chat_context_cache.set(email, context)
+
+    # Only the most recent turn objects are downloaded — enough for the
+    # window Gemini actually sees
+    chat_keys = chat_keys_future.result()
+    recent = s3_service.get_chat_messages(chat_keys[-_TURNS_IN_WINDOW:])
 
-    # Append user message
     user_msg = {
         "id": str(uuid.uuid4()),
         "content": body.content,
         "isUser": True,
-        "timestamp": now,
+        "timestamp": started.isoformat(),
     }
-    messages.append(user_msg)
 
-    # Build Gemini conversation history
-    gemini_history = []
-    for msg in messages[:-1]:  # Exclude the current user message (sent separately)
-        role = "user" if msg["isUser"] else "model"
-        gemini_history.append({"role": role, "parts": [msg["content"]]})
+    # Build Gemini conversation history, excluding the current user message
+    # (sent separately)
+    gemini_history = [
+        {"role": "user" if msg["isUser"] else "model", "parts": [msg["content"]]}
+        for msg in recent[-HISTORY_WINDOW:]
+    ]
 
-    # Load context from latest scan/routine
-    context = _load_latest_context(email)
+    # Timestamp-first ids keep a session's turn objects in chronological order
+    turn_id = f"{started:%Y%m%dT%H%M%S%f}_{user_msg['id']}"
+    return {
+        "email": email,
+        "session_id": session_id,
+        "turn_key": s3_service.chat_turn_key(email, session_id, turn_id),
+        "user_msg": user_msg,
+        "gemini_history": gemini_history,
+        "context": context,
+        # Compaction after the turn only folds keys listed here, so turns
+        # saved meanwhile are left untouched
+        "chat_keys": chat_keys,
+    }
 
-    # Generate AI response
-    ai_text = gemini_service.generate_response(
-        user_message=body.content,
-        conversation_history=gemini_history,
-        context=context,
-    )
 
-    # Append AI response
+def _finish_turn(turn: dict, ai_text: str) -> dict:
+    """Persist the turn's user and AI messages as one new chat log object."""
     ai_msg = {
         "id": str(uuid.uuid4()),
         "content": ai_text,
         "isUser": False,
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
-    messages.append(ai_msg)
+    s3_service.put_json(turn["turn_key"], [turn["user_msg"], ai_msg])
+    return ai_msg
+
+
+def _compact_turn_session(turn: dict) -> None:
+    """Compact the turn's session if saving the turn took it over the limit."""
+    _compact_session(turn["email"], turn["session_id"], turn["chat_keys"] + [turn["turn_key"]])
 
-    # Persist conversation to S3
-    s3_service.put_json(chat_key, messages)
 
-    return ChatMessageSchema(**ai_msg)
+@router.post("/message", response_model=ChatMessageSchema)
+def send_message(
+    body: ChatMessageRequest,
+    background_tasks: BackgroundTasks,
+    email: str = Query(..., description="User email"),
+):
+    """Send a message and get an AI response."""
+    turn = _start_turn(email, body)
+
+    # Generate AI response
+    ai_text = gemini_service.generate_response(
+        user_message=body.content,
+        conversation_history=turn["gemini_history"],
+        context=turn["context"],
+    )
+
+    ai_msg = _finish_turn(turn, ai_text)
+    background_tasks.add_task(_compact_turn_session, turn)
+    return ai_msg
+
+
+@router.post("/message/stream")
+def send_message_stream(
+    body: ChatMessageRequest,
+    email: str = Query(..., description="User email"),
+):
+    """
+    Send a message and stream the AI response as Server-Sent Events.
+    Emits {"delta": text} events while Gemini generates, then a final
+    {"done": true, "message": ChatMessage} event once the turn is saved.
+    """
+    turn = _start_turn(email, body)
+
+    def event_stream():
+        chunks: List[str] = []
+        for delta in gemini_service.generate_response_stream(
+            user_message=body.content,
+            conversation_history=turn["gemini_history"],
+            context=turn["context"],
+        ):
+            chunks.append(delta)
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+
+        ai_msg = _finish_turn(turn, "".join(chunks))
+        yield f"data: {json.dumps({'done': True, 'message': ai_msg})}\n\n"
+
+    # Explicit identity encoding keeps GZipMiddleware from buffering the events
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Content-Encoding": "identity"},
+        background=BackgroundTask(_compact_turn_session, turn),
+    )
 
 
 @router.get("/history", response_model=List[ChatMessageSchema])
 def get_chat_history(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     email: str = Query(..., description="User email"),
     sessionId: Optional[str] = None,
 ):
-    """Get chat history for a session."""
+    """
+    Get chat history for a session.
+    Chat log objects are append-only, so a session's key listing identifies
+    its content: clients polling with a matching If-None-Match get a 304
+    after one LIST, without any message being downloaded. Compaction, run
+    after the response, changes the listing but not the content, so it costs
+    a polling client one extra full response.
+    """
     if not email or "@" not in email:
         raise HTTPException(status_code=400, detail="Valid email required")
 
     if sessionId:
-        chat_key = s3_service.chat_key(email, sessionId)
-        messages = s3_service.get_json(chat_key) or []
-        return [ChatMessageSchema(**m) for m in messages]
-
-    # If no session ID, list all sessions and return the latest
-    prefixes = s3_service.list_keys(s3_service.chat_prefix(email))
-    all_messages: List[dict] = []
-    for key in prefixes:
-        if key.endswith(".json"):
-            msgs = s3_service.get_json(key)
-            if msgs:
-                all_messages.extend(msgs)
+        keys = s3_service.get_chat_keys(email, sessionId)
+        if not keys:
+            return []
+        etag = _listing_etag(keys)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        chunks = s3_service.get_json_many(keys)
+        background_tasks.add_task(_compact_session, email, sessionId, keys, chunks)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+        return s3_service.merge_chat_chunks(chunks)
+
+    # If no session ID, merge every session: all log objects download in one
+    # concurrent batch, then are grouped by session for compaction
+    prefix = s3_service.chat_prefix(email)
+    keys = [key for key in s3_service.list_keys(prefix) if key.endswith(".json")]
+    chunks = s3_service.get_json_many(keys)
+    sessions: Dict[str, Tuple[List[str], list]] = {}
+    for key, chunk in zip(keys, chunks):
+        session_id = key[len(prefix):].split("/", 1)[0].removesuffix(".json")
+        session_keys, session_chunks = sessions.setdefault(session_id, ([], []))
+        session_keys.append(key)
+        session_chunks.append(chunk)
+    background_tasks.add_task(_compact_sessions, email, sessions)
+    all_messages = s3_service.merge_chat_chunks(chunks)
 
     # Sort by timestamp
     all_messages.sort(key=lambda m: m.get("timestamp", ""))
-    return [ChatMessageSchema(**m) for m in all_messages]
+    return all_messages
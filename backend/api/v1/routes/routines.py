@@ -2,53 +2,78 @@
 Routines router — read routine plans from S3.
 Routines are generated during scan upload.
 """
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Request, Response
 
+from backend.core.cache import latest_routine_cache
 from backend.schemas.routine import RoutinePlanSchema
 from backend.services.storage.s3_service import s3_service
 
 router = APIRouter(prefix="/routines", tags=["Routines"])
 
+# A scan's routine is written once at upload and never modified
+_SCAN_ROUTINE_CACHE_CONTROL = "private, max-age=3600"
+
+
+def _conditional(request: Request, response: Response, routine: dict, cache_control: str):
+    """
+    Tag the routine with an ETag (routine ids are unique per generated plan).
+    Returns a bare 304 if the client already holds this routine.
+    """
+    headers = {"ETag": f'"{routine.get("id", "")}"', "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return routine
+
+
+def _find_latest_routine(email: str) -> dict:
+    """Return the routine of the most recent scan that has one."""
+    latest = s3_service.get_latest_snapshot(email)
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No scans found")
+
+    if latest.get("routine"):
+        return latest["routine"]
+
+    # Latest scan has no routine — fall back to older scans
+    scans = s3_service.get_scan_analyses(email)
+
+    # Sort by date descending
+    scans.sort(key=lambda x: x[1].get("date", ""), reverse=True)
+
+    # Return the first routine found
+    for scan_id, _ in scans:
+        data = s3_service.get_json(s3_service.routine_key(email, scan_id))
+        if data:
+            return data
+
+    raise HTTPException(status_code=404, detail="No routines found")
+
 
 @router.get("/{scan_id}", response_model=RoutinePlanSchema)
 def get_routine(
     scan_id: str,
+    request: Request,
+    response: Response,
     email: str = Query(..., description="User email"),
 ):
     """Get the routine plan associated with a specific scan."""
     data = s3_service.get_json(s3_service.routine_key(email, scan_id))
     if data is None:
         raise HTTPException(status_code=404, detail="Routine not found for this scan")
-    return RoutinePlanSchema(**data)
+    return _conditional(request, response, data, _SCAN_ROUTINE_CACHE_CONTROL)
 
 
 @router.get("/latest/plan", response_model=RoutinePlanSchema)
 def get_latest_routine(
+    request: Request,
+    response: Response,
     email: str = Query(..., description="User email"),
 ):
     """Get the most recent routine plan for a user."""
-    prefixes = s3_service.list_prefixes(s3_service.scans_prefix(email))
-
-    if not prefixes:
-        raise HTTPException(status_code=404, detail="No scans found")
-
-    # Find the most recent scan that has a routine
-    # Collect all scan analyses to sort by date
-    scans_with_dates = []
-    for prefix in prefixes:
-        parts = prefix.rstrip("/").split("/")
-        scan_id = parts[-1]
-        analysis = s3_service.get_json(s3_service.analysis_key(email, scan_id))
-        if analysis:
-            scans_with_dates.append((scan_id, analysis.get("date", "")))
-
-    # Sort by date descending
-    scans_with_dates.sort(key=lambda x: x[1], reverse=True)
-
-    # Return the first routine found
-    for scan_id, _ in scans_with_dates:
-        data = s3_service.get_json(s3_service.routine_key(email, scan_id))
-        if data:
-            return RoutinePlanSchema(**data)
-
-    raise HTTPException(status_code=404, detail="No routines found")
+    routine = latest_routine_cache.get(email)
+    if routine is None:
+        routine = _find_latest_routine(email)
+        latest_routine_cache.set(email, routine)
+    # The latest plan changes on scan upload, so clients must revalidate
+    return _conditional(request, response, routine, "private, no-cache")
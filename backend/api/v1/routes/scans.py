@@ -4,9 +4,11 @@ Scans router — upload photos, run AI pipeline (Gemini Vision + local engine),
 from fastapi import APIRouter, Query, HTTPException, UploadFile, File, Form
 from typing import List
 from datetime import datetime, timezone
+import asyncio
 import uuid
 import json
 
+from backend.core.cache import chat_context_cache, latest_routine_cache
 from backend.schemas.scan import SkinScanSchema, ScanRecordSchema
 from backend.schemas.routine import RoutinePlanSchema
 from backend.services.storage.s3_service import s3_service
@@ -14,6 +16,55 @@ from backend.services.ai_pipeline import run_ai
 
 router = APIRouter(prefix="/scans", tags=["Scans"])
 
+# Map common insecurity strings to engine priority keys
+_PRIORITY_MAP = {
+    "acne": "acne",
+    "redness": "redness",
+    "texture": "texture",
+    "dryness": "dryness",
+    "dry skin": "dryness",
+    "oily skin": "acne",
+    "oiliness": "acne",
+    "pores": "texture",
+    "dark spots": "texture",
+    "wrinkles": "texture",
+    "sensitivity": "barrier",
+    "barrier": "barrier",
+}
+
+
+def _top_concerns(scores: List[dict]) -> List[str]:
+    """Pick top 3 concerns (highest scoring metrics)."""
+    sorted_scores = sorted(scores, key=lambda s: s.get("score", 0), reverse=True)
+    return [s["name"] for s in sorted_scores[:3]]
+
+
+def _scan_record(scan_id: str, analysis: dict) -> dict:
+    """Build the ScanRecordSchema summary for a scan's analysis."""
+    # Scans saved before topConcerns was stored fall back to computing it
+    top_concerns = analysis.get("topConcerns")
+    if top_concerns is None:
+        top_concerns = _top_concerns(analysis.get("scores", []))
+
+    return {
+        "id": scan_id,
+        "date": analysis.get("date", ""),
+        "overallScore": analysis.get("overallScore", 0),
+        "thumbnailSystemName": "face.smiling",
+        "concerns": top_concerns,
+    }
+
+
+def _mark_unfinished_scan(email: str, scan_id: str) -> None:
+    """
+    Record a scan that will never get an analysis (rejected for a retake, or
+    whose analysis failed) in the index, so history stops looking it up.
+    """
+    index_key = s3_service.scans_index_key(email)
+    records = s3_service.get_json(index_key) or []
+    records.append({"id": scan_id, "unfinished": True})
+    s3_service.put_json(index_key, records)
+
 
 @router.post("/upload", response_model=SkinScanSchema)
 async def upload_and_analyze(
@@ -44,20 +95,6 @@ async def upload_and_analyze(
     left_bytes = await left.read()
     right_bytes = await right.read()
 
-    # Upload images to S3
-    s3_service.upload_image(
-        s3_service.scan_image_key(email, scan_id, "front"), front_bytes
-    )
-    s3_service.upload_image(
-        s3_service.scan_image_key(email, scan_id, "left"), left_bytes
-    )
-    s3_service.upload_image(
-        s3_service.scan_image_key(email, scan_id, "right"), right_bytes
-    )
-
-    # Save concerns
-    s3_service.put_json(s3_service.concerns_key(email, scan_id), concerns_data)
-
     # Build quiz dict from concerns for the AI pipeline
     quiz = {
         "sensitivity": concerns_data.get("sensitivityLevel", "Low") == "High",
@@ -67,34 +104,50 @@ async def upload_and_analyze(
 
     # Determine priority from user's biggest insecurity
     priority = concerns_data.get("biggestInsecurity", "").lower().strip()
-    # Map common insecurity strings to engine priority keys
-    priority_map = {
-        "acne": "acne",
-        "redness": "redness",
-        "texture": "texture",
-        "dryness": "dryness",
-        "dry skin": "dryness",
-        "oily skin": "acne",
-        "oiliness": "acne",
-        "pores": "texture",
-        "dark spots": "texture",
-        "wrinkles": "texture",
-        "sensitivity": "barrier",
-        "barrier": "barrier",
-    }
-    priority = priority_map.get(priority, priority if priority else "acne")
-
-    # Run the full AI pipeline
-    result = run_ai(
-        front_bytes=front_bytes,
-        left_bytes=left_bytes,
-        right_bytes=right_bytes,
-        quiz=quiz,
-        priority=priority,
+    priority = _PRIORITY_MAP.get(priority, priority if priority else "acne")
+
+    # Upload images and save concerns to S3 concurrently, off the event loop
+    storage = asyncio.gather(
+        asyncio.to_thread(
+            s3_service.upload_image,
+            s3_service.scan_image_key(email, scan_id, "front"), front_bytes,
+        ),
+        asyncio.to_thread(
+            s3_service.upload_image,
+            s3_service.scan_image_key(email, scan_id, "left"), left_bytes,
+        ),
+        asyncio.to_thread(
+            s3_service.upload_image,
+            s3_service.scan_image_key(email, scan_id, "right"), right_bytes,
+        ),
+        asyncio.to_thread(
+            s3_service.put_json,
+            s3_service.concerns_key(email, scan_id), concerns_data,
+        ),
     )
 
-    # Check for retake
+    # Run the full AI pipeline — the Gemini Vision call is blocking and slow,
+    # so keep it on a worker thread instead of stalling the event loop. It
+    # only needs the in-memory bytes, so the S3 writes above overlap with it.
+    try:
+        _, result = await asyncio.gather(
+            storage,
+            asyncio.to_thread(
+                run_ai,
+                front_bytes=front_bytes,
+                left_bytes=left_bytes,
+                right_bytes=right_bytes,
+                quiz=quiz,
+                priority=priority,
+            ),
+        )
+    except Exception:
+        await asyncio.to_thread(_mark_unfinished_scan, email, scan_id)
+        raise
+
+    # Check for retake; its images and concerns are stored all the same
     if result.get("retake_required"):
+        await asyncio.to_thread(_mark_unfinished_scan, email, scan_id)
         raise HTTPException(
             status_code=422,
             detail={
@@ -117,11 +170,10 @@ async def upload_and_analyze(
         "scores": analysis["scores"],
         "overallScore": analysis["overallScore"],
         "summary": analysis["summary"],
+        # Precomputed for history listings so reads don't re-sort scores
+        "topConcerns": _top_concerns(analysis["scores"]),
     }
 
-    # Save analysis to S3
-    s3_service.put_json(s3_service.analysis_key(email, scan_id), scan_data)
-
     # Get the routine from the pipeline result (already in legacy format)
     routine_raw = result.get("routine", {"morningSteps": [], "eveningSteps": [], "weeklySteps": []})
     routine_data = {
@@ -132,21 +184,44 @@ async def upload_and_analyze(
         "weeklySteps": routine_raw.get("weeklySteps", []),
     }
 
-    # Save routine to S3
-    s3_service.put_json(s3_service.routine_key(email, scan_id), routine_data)
-
-    # Also save raw metrics and plan for future trend tracking
-    s3_service.put_json(
-        f"users/{email}/scans/{scan_id}/raw_metrics.json",
-        result.get("metrics", {}),
+    # Re-read the index and the latest-scan snapshot just before writing:
+    # other uploads may have landed during the Gemini call. Any scan a racing
+    # writer still drops from the index is added back by history, which
+    # reconciles it with the scan listing.
+    index_key = s3_service.scans_index_key(email)
+    latest_key = s3_service.latest_scan_key(email)
+    scan_index, latest = await asyncio.to_thread(
+        s3_service.get_json_many, [index_key, latest_key]
     )
+
+    # Save analysis and routine, plus raw metrics and plan for future
+    # trend tracking, to S3 in one concurrent batch
+    outputs = {
+        s3_service.analysis_key(email, scan_id): scan_data,
+        s3_service.routine_key(email, scan_id): routine_data,
+        f"users/{email}/scans/{scan_id}/raw_metrics.json": result.get("metrics", {}),
+    }
+    # Denormalised snapshot so chat context and the latest routine are one GET.
+    # Skipping it when a newer scan's snapshot is stored only narrows the race
+    # with an overlapping upload; readers also compare it with the scan index.
+    if latest is None or now >= latest.get("date", ""):
+        outputs[latest_key] = {
+            "scanId": scan_id,
+            "date": now,
+            "analysis": scan_data,
+            "routine": routine_data,
+            "concerns": concerns_data,
+        }
     if result.get("plan"):
-        s3_service.put_json(
-            f"users/{email}/scans/{scan_id}/plan.json",
-            result["plan"],
-        )
+        outputs[f"users/{email}/scans/{scan_id}/plan.json"] = result["plan"]
+    if scan_index is not None:
+        scan_index.append(_scan_record(scan_id, scan_data))
+        outputs[index_key] = scan_index
+    await asyncio.to_thread(s3_service.put_json_many, outputs)
+    latest_routine_cache.pop(email)
+    chat_context_cache.pop(email)
 
-    return SkinScanSchema(**scan_data)
+    return scan_data
 
 
 @router.get("/{scan_id}", response_model=SkinScanSchema)
@@ -158,39 +233,36 @@ def get_scan(
     data = s3_service.get_json(s3_service.analysis_key(email, scan_id))
     if data is None:
         raise HTTPException(status_code=404, detail="Scan not found")
-    return SkinScanSchema(**data)
+    return data
 
 
 @router.get("/history/list", response_model=List[ScanRecordSchema])
 def get_scan_history(
     email: str = Query(..., description="User email"),
 ):
-    """List all scans for a user as summary records."""
-    prefixes = s3_service.list_prefixes(s3_service.scans_prefix(email))
-    records: List[dict] = []
-
-    for prefix in prefixes:
-        # Extract scan_id from prefix like "users/email/scans/{scan_id}/"
-        parts = prefix.rstrip("/").split("/")
-        scan_id = parts[-1]
-
-        analysis = s3_service.get_json(s3_service.analysis_key(email, scan_id))
-        if analysis is None:
-            continue
-
-        # Pick top 3 concerns (highest scoring metrics)
-        scores = analysis.get("scores", [])
-        sorted_scores = sorted(scores, key=lambda s: s.get("score", 0), reverse=True)
-        top_concerns = [s["name"] for s in sorted_scores[:3]]
-
-        records.append({
-            "id": scan_id,
-            "date": analysis.get("date", ""),
-            "overallScore": analysis.get("overallScore", 0),
-            "thumbnailSystemName": "face.smiling",
-            "concerns": top_concerns,
-        })
-
-    # Sort by date descending
+    """
+    List all scans for a user as summary records.
+    Served from the per-user scan index, reconciled against the scan folder
+    listing: scans missing from the index (lost to an overlapping upload, or
+    predating it) have their analyses fetched and are added back. Scans
+    marked unfinished stay in the index, so they are never looked up again,
+    but are left out of the listing.
+    """
+    index_key = s3_service.scans_index_key(email)
+    records = s3_service.get_json(index_key) or []
+
+    indexed = {r["id"] for r in records}
+    missing = [scan_id for scan_id in s3_service.list_scan_ids(email) if scan_id not in indexed]
+    # Scans still uploading have no analysis yet and are picked up later
+    added = [
+        _scan_record(scan_id, analysis)
+        for scan_id, analysis in s3_service.get_scan_analyses(email, missing)
+    ]
+    if added:
+        records = records + added
+        s3_service.put_json(index_key, records)
+
+    # Drop unfinished markers and sort by date descending
+    records = [r for r in records if not r.get("unfinished")]
     records.sort(key=lambda r: r["date"], reverse=True)
-    return [ScanRecordSchema(**r) for r in records]
+    return records
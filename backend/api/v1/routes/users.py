@@ -5,6 +5,7 @@ No auth — user identified by email query param.
 from fastapi import APIRouter, Query, HTTPException
 import uuid
 
+from backend.core.cache import chat_context_cache
 from backend.schemas.user import UserProfileSchema, UserProfileUpdate
 from backend.services.storage.s3_service import s3_service
 
@@ -35,8 +36,9 @@ def get_profile(email: str = Query(..., description="User email")):
             "avatarSystemName": "person.crop.circle.fill",
         }
         s3_service.put_json(key, data)
+        chat_context_cache.pop(email)
 
-    return UserProfileSchema(**data)
+    return data
 
 
 @router.put("/profile", response_model=UserProfileSchema)
@@ -56,5 +58,6 @@ def update_profile(
     update_dict = update.model_dump(exclude_none=True)
     data.update(update_dict)
     s3_service.put_json(key, data)
+    chat_context_cache.pop(email)
 
-    return UserProfileSchema(**data)
+    return data
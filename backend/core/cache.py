@@ -0,0 +1,56 @@
+"""
+In-process TTL caches for hot per-user reads.
+Single-instance deployment, so a process-local cache is enough; every
+writer is responsible for invalidating the keys it touches.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from backend.core.config import settings
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# Latest routine plan per user email — invalidated on scan upload
+latest_routine_cache = TTLCache(maxsize=1024, ttl=settings.CACHE_TTL_SECONDS)
+
+# Chat context per user email — invalidated on scan upload and profile writes
+chat_context_cache = TTLCache(maxsize=1024, ttl=settings.CACHE_TTL_SECONDS)
+
+# Gemini chat replies keyed by a hash of the exact request — entries carry
+# their full context, so they never need invalidating, only expiry
+chat_response_cache = TTLCache(maxsize=2048, ttl=settings.CHAT_CACHE_TTL_SECONDS)
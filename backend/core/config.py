@@ -21,11 +21,18 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_REGION: str = "us-east-1"
     S3_BUCKET_NAME: str = "dermalens-bucket"
+    S3_MAX_WORKERS: int = 10
+    S3_MAX_POOL_CONNECTIONS: int = 50
 
     # Gemini AI
     GEMINI_API_KEY: Optional[str] = None
     GEMINI_MODEL: str = "gemini-2.5-flash"
     GEMINI_VISION_MODEL: str = "gemini-2.5-flash"
+    GEMINI_MAX_INFLIGHT: int = 16
+
+    # In-process caches
+    CACHE_TTL_SECONDS: int = 60
+    CHAT_CACHE_TTL_SECONDS: int = 3600
 
     # Image limits
     MAX_IMAGE_SIZE_MB: int = 10
@@ -34,6 +41,8 @@ class Settings(BaseSettings):
         env_file=".env",
         env_file_encoding="utf-8",
         case_sensitive=True,
+        # Read once at startup; modules bind values at import, so no mutation
+        frozen=True,
     )
 
 
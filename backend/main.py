@@ -4,6 +4,8 @@ S3-only backend — no database, no auth.
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 import logging
 
 from backend.api.v1.router import api_router
@@ -21,6 +23,7 @@ app = FastAPI(
     docs_url=f"{settings.API_V1_PREFIX}/docs",
     redoc_url=f"{settings.API_V1_PREFIX}/redoc",
     openapi_url=f"{settings.API_V1_PREFIX}/openapi.json",
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -31,6 +34,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# History and analysis payloads are repetitive JSON; level 5 balances CPU vs ratio
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
 @app.get("/health")
 def health_check():
@@ -3,10 +3,15 @@ Gemini AI Chat Service
 Handles conversational AI for skincare guidance — simplified for S3-only backend.
 Updated to use the new google.genai SDK.
 """
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import threading
+import unicodedata
+from typing import Iterator, List, Dict, Optional
 
+import orjson
 from google.genai import Client, types
+from backend.core.cache import chat_response_cache
 from backend.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -29,6 +34,25 @@ Important Guidelines:
 If a user reports severe symptoms (severe burning, bleeding, extreme reactions),
 immediately suggest they stop the product and consult a healthcare provider."""
 
+# Fixed head of every system instruction that carries user context
+_CONTEXT_HEADER = SYSTEM_PROMPT + "\n\nCurrent Context:"
+
+# Number of previous messages sent to Gemini with each request
+HISTORY_WINDOW = 10
+
+FALLBACK_RESPONSE = (
+    "I'm having trouble processing your request right now. "
+    "Please try again in a moment."
+)
+
+
+def _format_score(score: dict) -> str:
+    return f"{score['name']}: {score['score']}"
+
+
+def _step_names(steps: List[Dict]) -> str:
+    return ", ".join(step["name"] for step in steps)
+
 
 class GeminiChatService:
     """Service for Gemini AI chat interactions."""
@@ -36,6 +60,9 @@ class GeminiChatService:
     def __init__(self):
         self.client = Client(api_key=settings.GEMINI_API_KEY)
         self.model_id = settings.GEMINI_MODEL
+        # Caps concurrent Gemini calls so bursts queue here instead of
+        # tripping provider rate limits
+        self._inflight = threading.BoundedSemaphore(settings.GEMINI_MAX_INFLIGHT)
 
     def generate_response(
         self,
@@ -55,82 +82,154 @@ class GeminiChatService:
         Returns:
             AI response text
         """
+        system_instruction = self._build_system_instruction(context)
+        cache_key = self._cache_key(system_instruction, user_message, conversation_history)
+        cached = chat_response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            contextualized_prompt = self._build_prompt(user_message, context)
-
-            # Build contents from conversation history (last 10 messages)
-            history = conversation_history[-10:]
-            contents = []
-            for msg in history:
-                role = msg.get("role", "user")
-                parts_data = msg.get("parts", [])
-                text_parts = []
-                for p in parts_data:
-                    if isinstance(p, str):
-                        text_parts.append(types.Part(text=p))
-                    elif isinstance(p, dict) and "text" in p:
-                        text_parts.append(types.Part(text=p["text"]))
-                if text_parts:
-                    contents.append(types.Content(role=role, parts=text_parts))
-
-            # Add the current user message
-            contents.append(
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text=contextualized_prompt)],
+            with self._inflight:
+                resp = self.client.models.generate_content(
+                    model=self.model_id,
+                    contents=self._build_contents(user_message, conversation_history),
+                    config=self._generation_config(system_instruction),
                 )
-            )
-
-            resp = self.client.models.generate_content(
-                model=self.model_id,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=SYSTEM_PROMPT,
-                    temperature=0.7,
-                ),
-            )
+            if resp.text:
+                chat_response_cache.set(cache_key, resp.text)
             return resp.text
 
         except Exception as e:
-            logger.error(f"Gemini API error: {e}")
-            return (
-                "I'm having trouble processing your request right now. "
-                "Please try again in a moment."
-            )
+            logger.error("Gemini API error: %s", e)
+            return FALLBACK_RESPONSE
 
-    def _build_prompt(self, user_message: str, context: Optional[Dict]) -> str:
-        """Build context-aware prompt."""
-        parts = []
-
-        if context:
-            parts.append("Current Context:")
-            if context.get("user_name"):
-                parts.append(f"User: {context['user_name']}")
-            if context.get("latest_analysis"):
-                analysis = context["latest_analysis"]
-                scores_str = ", ".join(
-                    f"{s['name']}: {s['score']}" for s in analysis.get("scores", [])
-                )
-                parts.append(f"Latest Skin Scores: {scores_str}")
-                parts.append(f"Overall Score: {analysis.get('overallScore', 'N/A')}")
-                parts.append(f"Summary: {analysis.get('summary', 'N/A')}")
-            if context.get("routine"):
-                routine = context["routine"]
-                morning_names = [s["name"] for s in routine.get("morningSteps", [])]
-                evening_names = [s["name"] for s in routine.get("eveningSteps", [])]
-                parts.append(f"Morning Routine: {', '.join(morning_names)}")
-                parts.append(f"Evening Routine: {', '.join(evening_names)}")
-            if context.get("concerns"):
-                concerns = context["concerns"]
-                parts.append(
-                    f"Primary Concerns: {', '.join(concerns.get('primaryConcerns', []))}"
-                )
-                parts.append(
-                    f"Skin Type: {concerns.get('skinType', 'Unknown')}"
+    def generate_response_stream(
+        self,
+        user_message: str,
+        conversation_history: List[Dict],
+        context: Optional[Dict] = None,
+    ) -> Iterator[str]:
+        """
+        Stream the AI response as text chunks while Gemini generates it.
+        Same arguments as generate_response. Yields the fallback message
+        if the request fails before any text was produced.
+        """
+        system_instruction = self._build_system_instruction(context)
+        cache_key = self._cache_key(system_instruction, user_message, conversation_history)
+        cached = chat_response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks: List[str] = []
+        try:
+            # Held for the whole stream; released when the generator closes
+            with self._inflight:
+                stream = self.client.models.generate_content_stream(
+                    model=self.model_id,
+                    contents=self._build_contents(user_message, conversation_history),
+                    config=self._generation_config(system_instruction),
                 )
-            parts.append("")
+                for chunk in stream:
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                        yield chunk.text
+            if chunks:
+                chat_response_cache.set(cache_key, "".join(chunks))
+
+        except Exception as e:
+            logger.error("Gemini API streaming error: %s", e)
+            if not chunks:
+                yield FALLBACK_RESPONSE
+
+    def _cache_key(
+        self,
+        system_instruction: str,
+        user_message: str,
+        conversation_history: List[Dict],
+    ) -> str:
+        """
+        Hash exactly what Gemini would see: model, system instruction (which
+        embeds the user's context), the history window, and the message.
+        """
+        payload = orjson.dumps(
+            [
+                self.model_id,
+                system_instruction,
+                conversation_history[-HISTORY_WINDOW:],
+                unicodedata.normalize("NFC", user_message.strip()),
+            ],
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.sha256(payload).hexdigest()
+
+    def _build_contents(
+        self,
+        user_message: str,
+        conversation_history: List[Dict],
+    ) -> List[types.Content]:
+        """Build request contents from recent history and the new message."""
+        history = conversation_history[-HISTORY_WINDOW:]
+        contents = []
+        for msg in history:
+            role = msg.get("role", "user")
+            parts_data = msg.get("parts", [])
+            text_parts = []
+            for p in parts_data:
+                if isinstance(p, str):
+                    text_parts.append(types.Part(text=p))
+                elif isinstance(p, dict) and "text" in p:
+                    text_parts.append(types.Part(text=p["text"]))
+            if text_parts:
+                contents.append(types.Content(role=role, parts=text_parts))
+
+        # Add the current user message
+        contents.append(
+            types.Content(
+                role="user",
+                parts=[types.Part(text=user_message)],
+            )
+        )
+        return contents
+
+    def _generation_config(self, system_instruction: str) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=0.7,
+        )
+
+    def _build_system_instruction(self, context: Optional[Dict]) -> str:
+        """
+        Build the system instruction: fixed prompt followed by the user's context.
+        The context only changes when a new scan is uploaded, so keeping it ahead
+        of the conversation gives every turn of a session the same request prefix
+        and lets Gemini's implicit caching reuse it.
+        """
+        if not context:
+            return SYSTEM_PROMPT
+
+        parts = [_CONTEXT_HEADER]
+        if context.get("user_name"):
+            parts.append(f"User: {context['user_name']}")
+        if context.get("latest_analysis"):
+            analysis = context["latest_analysis"]
+            scores_str = ", ".join(map(_format_score, analysis.get("scores", [])))
+            parts.append(f"Latest Skin Scores: {scores_str}")
+            parts.append(f"Overall Score: {analysis.get('overallScore', 'N/A')}")
+            parts.append(f"Summary: {analysis.get('summary', 'N/A')}")
+        if context.get("routine"):
+            routine = context["routine"]
+            parts.append(f"Morning Routine: {_step_names(routine.get('morningSteps', []))}")
+            parts.append(f"Evening Routine: {_step_names(routine.get('eveningSteps', []))}")
+        if context.get("concerns"):
+            concerns = context["concerns"]
+            parts.append(
+                f"Primary Concerns: {', '.join(concerns.get('primaryConcerns', []))}"
+            )
+            parts.append(
+                f"Skin Type: {concerns.get('skinType', 'Unknown')}"
+            )
 
-        parts.append(f"User Message: {user_message}")
         return "\n".join(parts)
 
 
@@ -1,10 +1,10 @@
 """Ingredient conflict pairs — used to prevent unsafe combinations."""
 
-CONFLICTS = [
+CONFLICTS = frozenset({
     ("retinoid", "strong_acid"),
     ("retinoid", "benzoyl_peroxide"),
     ("strong_acid", "strong_acid"),
-]
+})
 
 
 def has_conflict(a: str, b: str) -> bool:
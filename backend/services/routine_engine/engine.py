@@ -3,111 +3,150 @@ Local rule-based routine engine.
 Builds AM/PM skincare routines from SkinMetrics + profile.
 Priority-first active ingredient selection, safety adjustments, ramp schedule.
 """
+from operator import attrgetter
 from typing import Dict, Any, List, Optional
 from backend.services.scoring.metrics import SkinMetrics
 
 
+# Plan templates shared by every build_plan call (copied before editing)
+_AM_STEPS = (
+    {
+        "step_name": "cleanser",
+        "ingredient_focus": ["gentle cleanser"],
+        "frequency": "daily",
+        "why": "Maintain clean skin without stripping the barrier."
+    },
+    {
+        "step_name": "moisturizer",
+        "ingredient_focus": ["ceramides"],
+        "frequency": "daily",
+        "why": "Support skin barrier and reduce irritation risk."
+    },
+    {
+        "step_name": "sunscreen",
+        "ingredient_focus": ["broad spectrum SPF 30+"],
+        "frequency": "daily",
+        "why": "Protect skin and prevent worsening of discoloration/irritation."
+    },
+)
+
+_PM_STEPS = (
+    {
+        "step_name": "cleanser",
+        "ingredient_focus": ["gentle cleanser"],
+        "frequency": "daily",
+        "why": "Remove sunscreen/oil buildup."
+    },
+    {
+        "step_name": "moisturizer",
+        "ingredient_focus": ["ceramides"],
+        "frequency": "daily",
+        "why": "Repair and hydrate overnight."
+    },
+)
+
+# Shared by the "barrier" and "dryness" priorities
+_PRIORITY_BARRIER = {
+    "step_name": "treatment",
+    "ingredient_focus": ["hyaluronic acid", "ceramides"],
+    "frequency": "daily",
+    "why": "You selected barrier/dryness as top priority; hydration and barrier support come first."
+}
+
+# priority -> (metrics gate, active step) for the user-selected focus
+_PRIORITY_ACTIVES = {
+    "redness": (lambda m: True, {
+        "step_name": "active",
+        "ingredient_focus": ["niacinamide (2-5%)"],
+        "frequency": "daily",
+        "why": "You selected redness as top priority; niacinamide is generally gentle and barrier-supportive."
+    }),
+    "texture": (lambda m: True, {
+        "step_name": "active",
+        "ingredient_focus": ["lactic acid (AHA) low strength"],
+        "frequency": "1-2x/week",
+        "why": "You selected texture as top priority; a low-strength AHA can help with texture when introduced slowly."
+    }),
+    "acne": (lambda m: m.acne >= 45 or m.oiliness >= 60, {
+        "step_name": "active",
+        "ingredient_focus": ["salicylic acid (BHA)"],
+        "frequency": "2-3x/week",
+        "why": "You selected acne as top priority; acne/oiliness is elevated and BHA can help unclog pores."
+    }),
+    "barrier": (lambda m: True, _PRIORITY_BARRIER),
+    "dryness": (lambda m: True, _PRIORITY_BARRIER),
+}
+
+# (concern, metric, active step) tried in order when no priority active applies;
+# the first listed concern whose metric is >= 50 wins
+_FALLBACK_ACTIVES = (
+    ("acne", attrgetter("acne"), {
+        "step_name": "active",
+        "ingredient_focus": ["salicylic acid (BHA)"],
+        "frequency": "2-3x/week",
+        "why": "Acne/oiliness elevated; BHA can help unclog pores."
+    }),
+    ("redness", attrgetter("redness"), {
+        "step_name": "active",
+        "ingredient_focus": ["niacinamide (2-5%)"],
+        "frequency": "daily",
+        "why": "Visible redness detected; niacinamide is generally gentle and supportive."
+    }),
+    ("barrier", attrgetter("dryness"), {
+        "step_name": "treatment",
+        "ingredient_focus": ["hyaluronic acid", "ceramides"],
+        "frequency": "daily",
+        "why": "Dryness/barrier concern; focus on hydration and barrier support first."
+    }),
+)
+
+# ramp schedule (simple)
+_RAMP_SCHEDULE = {
+    "week_1": "Stick to gentle cleanser + moisturizer + sunscreen. If an active is included, use it only 1-2 nights this week.",
+    "week_2": "If no irritation (burning, peeling, stinging), increase active frequency slightly (e.g., 2-3 nights/week depending on the active).",
+    "week_3": "Maintain schedule. Avoid adding new actives — consistency matters more than stacking products.",
+    "week_4": "Re-scan and adjust only if metrics improved or irritation is present."
+}
+
+_AVOID = (
+    {"combo": "stacking multiple strong actives", "why": "Increases irritation risk, especially early."},
+    {"combo": "introducing new products every few days", "why": "Hard to identify what causes irritation."},
+)
+_AVOID_SENSITIVE = {"combo": "retinoids/strong acids early", "why": "Higher sensitivity signals detected; start gentler and slower."}
+
+_DISCLAIMER = "Not medical advice. If severe, painful, or worsening symptoms occur, consult a dermatologist."
+
+
+def _copy_step(step: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a template step, including its ingredient_focus list."""
+    return {**step, "ingredient_focus": list(step["ingredient_focus"])}
+
+
 def build_plan(metrics: SkinMetrics, profile: Dict[str, Any]) -> Dict[str, Any]:
     concerns: List[str] = profile.get("concerns", [])
     irritation: str = profile.get("irritation_risk", "low")
     priority: Optional[str] = profile.get("priority")
 
-    am = [
-        {
-            "step_name": "cleanser",
-            "ingredient_focus": ["gentle cleanser"],
-            "frequency": "daily",
-            "why": "Maintain clean skin without stripping the barrier."
-        },
-        {
-            "step_name": "moisturizer",
-            "ingredient_focus": ["ceramides"],
-            "frequency": "daily",
-            "why": "Support skin barrier and reduce irritation risk."
-        },
-        {
-            "step_name": "sunscreen",
-            "ingredient_focus": ["broad spectrum SPF 30+"],
-            "frequency": "daily",
-            "why": "Protect skin and prevent worsening of discoloration/irritation."
-        },
-    ]
-
-    pm = [
-        {
-            "step_name": "cleanser",
-            "ingredient_focus": ["gentle cleanser"],
-            "frequency": "daily",
-            "why": "Remove sunscreen/oil buildup."
-        },
-        {
-            "step_name": "moisturizer",
-            "ingredient_focus": ["ceramides"],
-            "frequency": "daily",
-            "why": "Repair and hydrate overnight."
-        },
-    ]
+    # Fresh copies so a returned plan never aliases the module templates
+    am = [_copy_step(step) for step in _AM_STEPS]
+    pm = [_copy_step(step) for step in _PM_STEPS]
 
     # ---- ACTIVE PICKING LOGIC (Priority-first, one active max) ----
     active = None
 
     # 1) PRIORITY FIRST (user-selected focus)
-    if priority == "redness":
-        active = {
-            "step_name": "active",
-            "ingredient_focus": ["niacinamide (2-5%)"],
-            "frequency": "daily",
-            "why": "You selected redness as top priority; niacinamide is generally gentle and barrier-supportive."
-        }
-
-    elif priority == "texture":
-        active = {
-            "step_name": "active",
-            "ingredient_focus": ["lactic acid (AHA) low strength"],
-            "frequency": "1-2x/week",
-            "why": "You selected texture as top priority; a low-strength AHA can help with texture when introduced slowly."
-        }
-
-    elif priority == "acne":
-        if metrics.acne >= 45 or metrics.oiliness >= 60:
-            active = {
-                "step_name": "active",
-                "ingredient_focus": ["salicylic acid (BHA)"],
-                "frequency": "2-3x/week",
-                "why": "You selected acne as top priority; acne/oiliness is elevated and BHA can help unclog pores."
-            }
-
-    elif priority == "barrier" or priority == "dryness":
-        active = {
-            "step_name": "treatment",
-            "ingredient_focus": ["hyaluronic acid", "ceramides"],
-            "frequency": "daily",
-            "why": "You selected barrier/dryness as top priority; hydration and barrier support come first."
-        }
+    rule = _PRIORITY_ACTIVES.get(priority)
+    if rule is not None:
+        applies, step = rule
+        if applies(metrics):
+            active = _copy_step(step)
 
     # 2) FALLBACK (if priority didn't set an active)
     if active is None:
-        if "acne" in concerns and metrics.acne >= 50:
-            active = {
-                "step_name": "active",
-                "ingredient_focus": ["salicylic acid (BHA)"],
-                "frequency": "2-3x/week",
-                "why": "Acne/oiliness elevated; BHA can help unclog pores."
-            }
-        elif "redness" in concerns and metrics.redness >= 50:
-            active = {
-                "step_name": "active",
-                "ingredient_focus": ["niacinamide (2-5%)"],
-                "frequency": "daily",
-                "why": "Visible redness detected; niacinamide is generally gentle and supportive."
-            }
-        elif "barrier" in concerns and metrics.dryness >= 50:
-            active = {
-                "step_name": "treatment",
-                "ingredient_focus": ["hyaluronic acid", "ceramides"],
-                "frequency": "daily",
-                "why": "Dryness/barrier concern; focus on hydration and barrier support first."
-            }
+        for concern, get_score, step in _FALLBACK_ACTIVES:
+            if concern in concerns and get_score(metrics) >= 50:
+                active = _copy_step(step)
+                break
 
     # Safety tweak: if irritation risk is high, reduce frequency of acids
     if active is not None and irritation == "high":
@@ -120,26 +159,15 @@ def build_plan(metrics: SkinMetrics, profile: Dict[str, Any]) -> Dict[str, Any]:
     if active:
         pm.insert(1, active)
 
-    # ramp schedule (simple)
-    ramp = {
-        "week_1": "Stick to gentle cleanser + moisturizer + sunscreen. If an active is included, use it only 1-2 nights this week.",
-        "week_2": "If no irritation (burning, peeling, stinging), increase active frequency slightly (e.g., 2-3 nights/week depending on the active).",
-        "week_3": "Maintain schedule. Avoid adding new actives — consistency matters more than stacking products.",
-        "week_4": "Re-scan and adjust only if metrics improved or irritation is present."
-    }
-
-    avoid = [
-        {"combo": "stacking multiple strong actives", "why": "Increases irritation risk, especially early."},
-        {"combo": "introducing new products every few days", "why": "Hard to identify what causes irritation."},
-    ]
+    avoid = [dict(item) for item in _AVOID]
     if irritation in ("medium", "high"):
-        avoid.append({"combo": "retinoids/strong acids early", "why": "Higher sensitivity signals detected; start gentler and slower."})
+        avoid.append(dict(_AVOID_SENSITIVE))
 
     return {
         "profile": profile,
         "am_steps": am,
         "pm_steps": pm,
-        "ramp_schedule": ramp,
+        "ramp_schedule": dict(_RAMP_SCHEDULE),
         "avoid": avoid,
-        "disclaimer": "Not medical advice. If severe, painful, or worsening symptoms occur, consult a dermatologist.",
+        "disclaimer": _DISCLAIMER,
     }
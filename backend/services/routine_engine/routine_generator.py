@@ -3,28 +3,29 @@ Routine generation — now uses the local rule-based engine
 instead of delegating to Gemini.
 Kept for import compatibility.
 """
+import uuid
+
 from backend.services.routine_engine.engine import build_plan
 
 
+def _step(order: int, raw: dict) -> dict:
+    """Convert an engine step dict to RoutineStepSchema-compatible dict."""
+    step_name = raw.get("step_name", "step")
+    return {
+        "id": str(uuid.uuid4()),
+        "order": order,
+        "name": step_name,
+        "description": raw.get("why", ""),
+        "productSuggestion": ", ".join(raw.get("ingredient_focus", [])),
+        "icon": _icon_for_step(step_name),
+    }
+
+
 def generate_routine_from_plan(plan: dict) -> dict:
     """
     Convert the engine's plan dict into the legacy RoutinePlanSchema shape
     (morningSteps, eveningSteps, weeklySteps) expected by the iOS client.
     """
-    import uuid
-
-    def _step(order: int, raw: dict) -> dict:
-        """Convert an engine step dict to RoutineStepSchema-compatible dict."""
-        ingredients = ", ".join(raw.get("ingredient_focus", []))
-        return {
-            "id": str(uuid.uuid4()),
-            "order": order,
-            "name": raw.get("step_name", "step"),
-            "description": raw.get("why", ""),
-            "productSuggestion": ingredients,
-            "icon": _icon_for_step(raw.get("step_name", "")),
-        }
-
     morning = [_step(i + 1, s) for i, s in enumerate(plan.get("am_steps", []))]
     evening = [_step(i + 1, s) for i, s in enumerate(plan.get("pm_steps", []))]
 
@@ -38,14 +39,17 @@ def generate_routine_from_plan(plan: dict) -> dict:
     }
 
 
+# Engine step names → SF Symbol icons for the iOS client
+_STEP_ICONS = {
+    "cleanser": "drop.fill",
+    "moisturizer": "humidity.fill",
+    "sunscreen": "sun.max.trianglebadge.exclamationmark.fill",
+    "active": "testtube.2",
+    "treatment": "testtube.2",
+    "serum": "testtube.2",
+}
+
+
 def _icon_for_step(step_name: str) -> str:
     """Map engine step names to SF Symbol icons for the iOS client."""
-    icons = {
-        "cleanser": "drop.fill",
-        "moisturizer": "humidity.fill",
-        "sunscreen": "sun.max.trianglebadge.exclamationmark.fill",
-        "active": "testtube.2",
-        "treatment": "testtube.2",
-        "serum": "testtube.2",
-    }
-    return icons.get(step_name.lower(), "sparkles")
+    return _STEP_ICONS.get(step_name.lower(), "sparkles")
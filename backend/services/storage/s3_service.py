@@ -3,9 +3,11 @@ AWS S3 storage service
 Primary data store — all user data lives as JSON files and images in S3.
 """
 import boto3
-import json
+import orjson
+from concurrent.futures import Future, ThreadPoolExecutor
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 import logging
 
 from backend.core.config import settings
@@ -22,8 +24,28 @@ class S3Service:
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
             region_name=settings.AWS_REGION,
+            # Default pool is 10 sockets, shared by request threads and the
+            # fan-out executor below; size it so neither starves the other.
+            # Keep-alive holds pooled sockets open between bursts, and a short
+            # connect timeout with adaptive retries bounds tail latency.
+            config=Config(
+                max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=5,
+                retries={"mode": "adaptive", "max_attempts": 5},
+            ),
         )
         self.bucket = settings.S3_BUCKET_NAME
+        # boto3 clients are thread-safe; independent GETs fan out over this pool
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.S3_MAX_WORKERS, thread_name_prefix="s3"
+        )
+        # Switched off if S3 refuses deletes: compaction would then only add objects
+        self._chat_compaction_enabled = True
+
+    def submit(self, fn, *args) -> Future:
+        """Run a call on the fan-out pool, e.g. to overlap a LIST with GETs."""
+        return self._executor.submit(fn, *args)
 
     # --- JSON operations ---
 
@@ -32,20 +54,56 @@ class S3Service:
         self.s3_client.put_object(
             Bucket=self.bucket,
             Key=key,
-            Body=json.dumps(data, default=str),
+            Body=orjson.dumps(data, default=str),
             ContentType="application/json",
         )
 
+    def put_json_many(self, items: Dict[str, dict]) -> None:
+        """Upload several JSON objects concurrently, keyed by S3 key."""
+        for future in [
+            self._executor.submit(self.put_json, key, data)
+            for key, data in items.items()
+        ]:
+            future.result()
+
     def get_json(self, key: str) -> Optional[dict]:
         """Download and parse a JSON object from S3. Returns None if not found."""
         try:
             response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
-            return json.loads(response["Body"].read().decode("utf-8"))
+            return orjson.loads(response["Body"].read())
         except ClientError as e:
             if e.response["Error"]["Code"] == "NoSuchKey":
                 return None
             raise
 
+    def get_json_many(self, keys: List[str]) -> List[Optional[dict]]:
+        """Fetch several JSON objects concurrently. Results keep the order of keys."""
+        if len(keys) <= 1:
+            return [self.get_json(key) for key in keys]
+        return list(self._executor.map(self.get_json, keys))
+
+    def delete_keys(self, keys: List[str]) -> List[dict]:
+        """
+        Delete objects in batches of up to 1000 keys per request. Returns the
+        per-key errors S3 reports ({Key, Code, Message}), which are logged.
+        """
+        errors: List[dict] = []
+        for start in range(0, len(keys), 1000):
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[start:start + 1000]],
+                    "Quiet": True,
+                },
+            )
+            errors.extend(response.get("Errors", []))
+        if errors:
+            logger.error(
+                "Failed to delete %d of %d objects (first: %s, %s)",
+                len(errors), len(keys), errors[0].get("Key"), errors[0].get("Code"),
+            )
+        return errors
+
     # --- Image operations ---
 
     def upload_image(self, key: str, image_data: bytes, content_type: str = "image/jpeg") -> str:
@@ -75,22 +133,175 @@ class S3Service:
                 ExpiresIn=expires_in,
             )
         except ClientError as e:
-            logger.error(f"Error generating presigned download URL: {e}")
+            logger.error("Error generating presigned download URL: %s", e)
             return None
 
     # --- Listing ---
 
     def list_prefixes(self, prefix: str) -> List[str]:
         """List sub-folders (common prefixes) under a given prefix."""
-        response = self.s3_client.list_objects_v2(
-            Bucket=self.bucket, Prefix=prefix, Delimiter="/"
-        )
-        return [cp["Prefix"] for cp in response.get("CommonPrefixes", [])]
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return [
+            cp["Prefix"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/")
+            for cp in page.get("CommonPrefixes", [])
+        ]
 
     def list_keys(self, prefix: str) -> List[str]:
-        """List all object keys under a given prefix."""
-        response = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
-        return [obj["Key"] for obj in response.get("Contents", [])]
+        """List all object keys under a given prefix, in S3's lexicographic order."""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return [
+            obj["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        ]
+
+    # --- Chat logs ---
+
+    def get_chat_keys(self, email: str, session_id: str) -> List[str]:
+        """
+        Keys holding a session's messages, oldest first: the single-object
+        transcript written before per-turn logs (if any), then one object per
+        turn. Turn keys start with a UTC timestamp, so listing order is
+        chronological.
+        """
+        legacy_key = self.chat_key(email, session_id)
+        turn_prefix = self.chat_turn_prefix(email, session_id)
+        return [
+            key for key in self.list_keys(legacy_key[: -len(".json")])
+            if key == legacy_key or key.startswith(turn_prefix)
+        ]
+
+    def get_chat_messages(self, keys: List[str]) -> List[dict]:
+        """Fetch chat log objects concurrently and flatten them into one list."""
+        return self.merge_chat_chunks(self.get_json_many(keys))
+
+    @staticmethod
+    def merge_chat_chunks(chunks: List[Optional[list]]) -> List[dict]:
+        """
+        Flatten fetched chat log objects into one list of messages.
+        Messages are deduplicated by id: a compacted transcript can briefly
+        coexist with the turn objects it replaces.
+        """
+        messages: List[dict] = []
+        seen = set()
+        for chunk in chunks:
+            for message in chunk or []:
+                if message.get("id") not in seen:
+                    seen.add(message.get("id"))
+                    messages.append(message)
+        return messages
+
+    def compact_chat(
+        self, email: str, session_id: str, keys: List[str], messages: List[dict]
+    ) -> None:
+        """
+        Replace a run of a session's oldest log objects with one transcript
+        holding their messages. The transcript is named after the newest
+        replaced object, so it lists before every object kept, and is written
+        before the originals are deleted so no message disappears.
+        """
+        if not self._chat_compaction_enabled:
+            return
+        stem = keys[-1].rsplit("/", 1)[-1].split(".", 1)[0]
+        compacted_key = f"{self.chat_turn_prefix(email, session_id)}{stem}.compacted.json"
+        self.put_json(compacted_key, messages)
+        errors = self.delete_keys([key for key in keys if key != compacted_key])
+        if any(error.get("Code") == "AccessDenied" for error in errors):
+            self._chat_compaction_enabled = False
+            logger.error("Chat compaction disabled: s3:DeleteObject is denied on %s", self.bucket)
+
+    # --- Scan lookups ---
+
+    def list_scan_ids(self, email: str) -> List[str]:
+        """Ids of every scan folder the user has, finished or not."""
+        return [
+            prefix.rstrip("/").split("/")[-1]
+            for prefix in self.list_prefixes(self.scans_prefix(email))
+        ]
+
+    def get_scan_analyses(
+        self, email: str, scan_ids: Optional[List[str]] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        Load (scan_id, analysis) pairs for every scan that has an analysis,
+        or only for scan_ids when given.
+        """
+        if scan_ids is None:
+            scan_ids = self.list_scan_ids(email)
+        analyses = self.get_json_many(
+            [self.analysis_key(email, scan_id) for scan_id in scan_ids]
+        )
+        return [
+            (scan_id, analysis)
+            for scan_id, analysis in zip(scan_ids, analyses)
+            if analysis
+        ]
+
+    def get_latest_snapshot(self, email: str) -> Optional[dict]:
+        """
+        Return the latest scan as {scanId, date, analysis, routine, concerns},
+        or None. Upload denormalises all of it into latest_scan.json, so this
+        is normally one round trip; older pointers are filled in from the scan.
+        """
+        pointer, index = self.get_json_many([
+            self.latest_scan_key(email),
+            self.scans_index_key(email),
+        ])
+        return self.resolve_latest_snapshot(email, pointer, index)
+
+    def resolve_latest_snapshot(
+        self, email: str, pointer: Optional[dict], index: Optional[list] = None
+    ) -> Optional[dict]:
+        """
+        Complete an already-fetched latest_scan.json into a snapshot, so
+        callers can fetch the pointer in the same batch as their other reads.
+        Overlapping uploads can leave the pointer on an older scan; when the
+        scan index is passed and lists a newer scan, the snapshot is rebuilt
+        from that scan and written back.
+        """
+        newest = max(
+            (r for r in index or [] if r.get("date")),
+            key=lambda r: r["date"],
+            default=None,
+        )
+        if newest and newest["date"] > ((pointer or {}).get("date") or ""):
+            # The index is written with the analysis, so this only misses
+            # while that upload's batch is still landing
+            analysis = self.get_json(self.analysis_key(email, newest["id"]))
+            if analysis:
+                snapshot = self._build_snapshot(email, newest["id"], analysis)
+                self.put_json(self.latest_scan_key(email), snapshot)
+                return snapshot
+
+        if pointer and "analysis" in pointer:
+            return pointer
+
+        analysis = None
+        if pointer:
+            scan_id = pointer["scanId"]
+            analysis = self.get_json(self.analysis_key(email, scan_id))
+        if not analysis:
+            # Users whose scans predate the pointer: enumerate every scan
+            scans = self.get_scan_analyses(email)
+            if not scans:
+                return None
+            scan_id, analysis = max(scans, key=lambda x: x[1].get("date", ""))
+        return self._build_snapshot(email, scan_id, analysis)
+
+    def _build_snapshot(self, email: str, scan_id: str, analysis: dict) -> dict:
+        """Assemble a latest-scan snapshot around a scan's analysis."""
+        routine, concerns = self.get_json_many([
+            self.routine_key(email, scan_id),
+            self.concerns_key(email, scan_id),
+        ])
+        return {
+            "scanId": scan_id,
+            "date": analysis.get("date"),
+            "analysis": analysis,
+            "routine": routine,
+            "concerns": concerns,
+        }
 
     # --- Path helpers ---
 
@@ -102,6 +313,14 @@ class S3Service:
     def profile_key(email: str) -> str:
         return f"users/{email}/profile.json"
 
+    @staticmethod
+    def latest_scan_key(email: str) -> str:
+        return f"users/{email}/latest_scan.json"
+
+    @staticmethod
+    def scans_index_key(email: str) -> str:
+        return f"users/{email}/scans_index.json"
+
     @staticmethod
     def scan_prefix(email: str, scan_id: str) -> str:
         return f"users/{email}/scans/{scan_id}/"
@@ -130,6 +349,14 @@ class S3Service:
     def chat_key(email: str, session_id: str) -> str:
         return f"users/{email}/chat/{session_id}.json"
 
+    @staticmethod
+    def chat_turn_prefix(email: str, session_id: str) -> str:
+        return f"users/{email}/chat/{session_id}/"
+
+    @staticmethod
+    def chat_turn_key(email: str, session_id: str, turn_id: str) -> str:
+        return f"users/{email}/chat/{session_id}/{turn_id}.json"
+
     @staticmethod
     def chat_prefix(email: str) -> str:
         return f"users/{email}/chat/"
@@ -6,6 +6,7 @@ Replaces the old google-generativeai manual-JSON-parsing approach.
 import os
 import uuid
 import logging
+from operator import attrgetter
 from typing import Optional
 
 from google.genai import Client, types
@@ -29,6 +30,16 @@ set:
 Return ONLY JSON that matches the schema exactly.
 """
 
+# One client for the process so vision calls reuse its HTTP connection pool
+_client = Client(api_key=settings.GEMINI_API_KEY)
+
+_GENERATION_CONFIG = types.GenerateContentConfig(
+    system_instruction=SYSTEM_INSTRUCTIONS,
+    response_mime_type="application/json",
+    response_schema=SkinMetrics,
+    temperature=0.2,
+)
+
 
 def _img_part(image_bytes: bytes, mime_type: str = "image/jpeg") -> types.Part:
     return types.Part(
@@ -45,8 +56,6 @@ def analyze_face_three_angles(
     Send 1-3 face photos to Gemini and get back structured SkinMetrics.
     Uses response_schema so the model returns validated JSON directly.
     """
-    client = Client(api_key=settings.GEMINI_API_KEY)
-
     parts = [
         types.Part(text="FRONT IMAGE:"),
         _img_part(front_bytes),
@@ -78,15 +87,10 @@ Return ONLY JSON matching the schema.
 """
     parts.append(types.Part(text=prompt))
 
-    resp = client.models.generate_content(
+    resp = _client.models.generate_content(
         model=MODEL_ID,
         contents=[types.Content(parts=parts)],
-        config=types.GenerateContentConfig(
-            system_instruction=SYSTEM_INSTRUCTIONS,
-            response_mime_type="application/json",
-            response_schema=SkinMetrics,
-            temperature=0.2,
-        ),
+        config=_GENERATION_CONFIG,
     )
 
     return resp.parsed
@@ -108,23 +112,26 @@ def _color_for_score(score: float) -> str:
     return "red"
 
 
+# (display name, SkinMetrics accessor, SF Symbol) in the order the client shows them
+_METRIC_DEFS = (
+    ("Acne", attrgetter("acne"), "circle.fill"),
+    ("Redness", attrgetter("redness"), "flame.fill"),
+    ("Oiliness", attrgetter("oiliness"), "drop.fill"),
+    ("Dryness", attrgetter("dryness"), "sun.max.fill"),
+    ("Texture", attrgetter("texture"), "square.grid.3x3.topleft.filled"),
+)
+
+
 def metrics_to_legacy_analysis(metrics: SkinMetrics) -> dict:
     """
     Convert the new SkinMetrics model to the dict shape that
     SkinScanSchema / the iOS client expects:
         {scores: [{name, score, icon, color, id}], overallScore, summary}
     """
-    metric_defs = [
-        ("Acne", metrics.acne, "circle.fill"),
-        ("Redness", metrics.redness, "flame.fill"),
-        ("Oiliness", metrics.oiliness, "drop.fill"),
-        ("Dryness", metrics.dryness, "sun.max.fill"),
-        ("Texture", metrics.texture, "square.grid.3x3.topleft.filled"),
-    ]
-
     scores = []
     total = 0
-    for name, value, icon in metric_defs:
+    for name, get_value, icon in _METRIC_DEFS:
+        value = get_value(metrics)
         total += value
         scores.append({
             "id": str(uuid.uuid4()),
@@ -135,7 +142,7 @@ def metrics_to_legacy_analysis(metrics: SkinMetrics) -> dict:
         })
 
     # Overall skin health = inverse of average issue severity
-    avg_issue = total / len(metric_defs)
+    avg_issue = total / len(_METRIC_DEFS)
     overall_score = round(100 - avg_issue, 1)
 
     # Build a short summary from notes or a generic one